@@ -0,0 +1,153 @@
+import time
+import const
+
+from typing import Callable, Optional
+
+class AdaptiveStreamController:
+    """
+    Keeps a ScrcpyClient stream real-time by renegotiating bitrate, fps and size within bounds
+    """
+    def __init__(
+        self,
+        client,
+        min_bitrate: int = 400000,
+        max_bitrate: int = 1600000,
+        min_fps: int = 10,
+        max_fps: int = 20,
+        min_width: Optional[int] = None,
+        max_width: Optional[int] = None,
+        queue_depth: Optional[Callable[[], int]] = None,
+        interval: float = 2.0,
+        settle: float = 3.0,
+        max_lag: float = 0.25,
+        max_queue: int = 5,
+        decode_budget: float = 0.8,
+        down_step: float = 0.25,
+        up_step: float = 0.1,
+        healthy_intervals: int = 3
+    ):
+        assert 0 <= min_bitrate <= max_bitrate, "bitrate bounds must satisfy 0 <= min <= max"
+        assert 0 <= min_fps <= max_fps, "fps bounds must satisfy 0 <= min <= max"
+        self.client = client
+        self.bounds = {
+            "bitrate": (min_bitrate, max_bitrate),
+            "max_fps": (min_fps, max_fps),
+            "max_width": (
+                min_width if min_width is not None else client.max_width,
+                max_width if max_width is not None else client.max_width
+            )
+        }
+        assert 0 <= self.bounds["max_width"][0] <= self.bounds["max_width"][1], "width bounds must satisfy 0 <= min <= max"
+        self.queue_depth = queue_depth
+        self.interval = interval
+        self.settle = settle
+        self.max_lag = max_lag
+        self.max_queue = max_queue
+        self.decode_budget = decode_budget
+        self.down_step = down_step
+        self.up_step = up_step
+        self.healthy_intervals = healthy_intervals
+
+        #start from the configured client parameters
+        self.quality = self._quality_for_bitrate(client.bitrate)
+        self.healthy_count = 0
+        self.stats = {}
+        self._reset_window(time.time() + settle)
+        return
+
+    def attach(self) -> None:
+        self.client.add_listener(const.ScrcpyEvents.PACKET, self.on_packet)
+        self.client.add_listener(const.ScrcpyEvents.FRAME, self.on_frame)
+        self.client.add_listener(const.ScrcpyEvents.RECONFIGURE, self.on_reconfigure)
+        return
+
+    def detach(self) -> None:
+        self.client.remove_listener(const.ScrcpyEvents.PACKET, self.on_packet)
+        self.client.remove_listener(const.ScrcpyEvents.FRAME, self.on_frame)
+        self.client.remove_listener(const.ScrcpyEvents.RECONFIGURE, self.on_reconfigure)
+        return
+
+    def _reset_window(self, start: float) -> None:
+        self.window_start = start
+        self.window_bytes = 0
+        self.window_frames = 0
+        self.window_lag = 0.0
+        self.window_decode = 0.0
+        self.packet_time = None
+        return
+
+    def _quality_for_bitrate(self, bitrate: float) -> float:
+        lo, hi = self.bounds["bitrate"]
+        if hi == lo:
+            return 1.0
+        return min(max((bitrate - lo) / (hi - lo), 0.0), 1.0)
+
+    def params_for_quality(self, quality: float) -> dict:
+        params = {}
+        for name, (lo, hi) in self.bounds.items():
+            #the server aligns dimensions itself, bounds are passed through as given
+            params[name] = int(round(lo + (hi - lo) * quality))
+        return params
+
+    def on_packet(self, packet, codec, pts) -> None:
+        now = time.time()
+        if now < self.window_start:
+            return
+        self.window_bytes += packet.size
+        self.packet_time = now
+        return
+
+    def on_frame(self, frame, pts) -> None:
+        now = time.time()
+        if now < self.window_start:
+            return
+        self.window_frames += 1
+        self.window_lag += now - (pts + self.client.offset * 0.001)
+        if self.packet_time is not None:
+            self.window_decode += now - self.packet_time
+        if now - self.window_start >= self.interval:
+            self._evaluate(now)
+        return
+
+    def on_reconfigure(self) -> None:
+        self._reset_window(time.time() + self.settle)
+        return
+
+    def _evaluate(self, now: float) -> None:
+        elapsed = now - self.window_start
+        frames = max(self.window_frames, 1)
+        fps = self.client.max_fps if self.client.max_fps > 0 else self.window_frames / elapsed
+        self.stats = {
+            "receive_rate": self.window_bytes * 8 / elapsed,
+            "frame_rate": self.window_frames / elapsed,
+            "lag": self.window_lag / frames,
+            "decode_time": self.window_decode / frames,
+            "queue_depth": self.queue_depth() if self.queue_depth is not None else 0
+        }
+        self._reset_window(now)
+
+        lagging = self.stats["lag"] > self.max_lag
+        decoder_overrun = fps > 0 and self.stats["decode_time"] > self.decode_budget / fps
+        queue_full = self.stats["queue_depth"] > self.max_queue
+
+        quality = self.quality
+        if lagging or decoder_overrun or queue_full:
+            self.healthy_count = 0
+            quality -= self.down_step
+            if lagging and self.stats["receive_rate"] < self.client.bitrate:
+                #link is the bottleneck, drop straight below what actually gets through
+                quality = min(quality, self._quality_for_bitrate(self.stats["receive_rate"] * 0.9))
+        else:
+            self.healthy_count += 1
+            if self.healthy_count >= self.healthy_intervals:
+                self.healthy_count = 0
+                quality += self.up_step
+        quality = min(max(quality, 0.0), 1.0)
+
+        params = self.params_for_quality(quality)
+        self.quality = quality
+        current = {name: getattr(self.client, name) for name in params}
+        if params != current:
+            print("Adaptive stream", self.stats, "->", params)
+            self.client.reconfigure(**params)
+        return
@@ -0,0 +1,232 @@
+import time
+import queue
+import threading
+import fractions
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+import av
+from av.codec import CodecContext
+
+MJPEG_BOUNDARY = "frame"
+
+class BroadcastClient:
+    def __init__(self, queue_limit):
+        self.queue = queue.Queue(queue_limit)
+        self.waiting_keyframe = True
+        return
+
+class BroadcastEncoder:
+    """
+    Encodes the latest submitted image on its own thread and fans the bitstream out to all clients
+    """
+    def __init__(
+        self,
+        codec_name: str = "mjpeg",
+        max_fps: int = 20,
+        bitrate: int = 4000000,
+        thread_count: int = 0,
+        thread_type: str = "SLICE",
+        options: Optional[dict] = None,
+        queue_limit: int = 30
+    ):
+        assert codec_name in ["mjpeg", "h264"]
+        assert max_fps > 0, "max_fps must be greater than 0"
+        assert thread_count >= 0, "thread_count must be greater than or equal to 0"
+        self.codec_name = codec_name
+        self.max_fps = max_fps
+        self.bitrate = bitrate
+        self.thread_count = thread_count
+        #frame threads hold back a packet per thread, slice threads keep one frame in, one packet out
+        self.thread_type = thread_type
+        if options is None:
+            #one frame in, one packet out
+            options = {"preset": "ultrafast", "tune": "zerolatency"} if codec_name == "h264" else {}
+        self.options = options
+        self.queue_limit = queue_limit
+
+        self.codec = None
+        self.frame_index = 0
+        self.latest = None
+        self.latest_cond = threading.Condition()
+        self.clients = []
+        self.clients_lock = threading.Lock()
+        self.encode_thread = None
+        self.alive = False
+        return
+
+    def start(self) -> None:
+        assert self.alive is False
+        self.alive = True
+        self.encode_thread = threading.Thread(target=self._encode_loop)
+        self.encode_thread.start()
+        return
+
+    def stop(self) -> None:
+        with self.latest_cond:
+            self.alive = False
+            self.latest_cond.notify()
+        if self.encode_thread is not None:
+            self.encode_thread.join()
+            self.encode_thread = None
+        return
+
+    def submit(self, image) -> None:
+        #a newer image replaces one the encoder has not picked up yet
+        with self.latest_cond:
+            self.latest = image
+            self.latest_cond.notify()
+        return
+
+    def add_client(self) -> BroadcastClient:
+        client = BroadcastClient(self.queue_limit)
+        with self.clients_lock:
+            self.clients.append(client)
+        return client
+
+    def remove_client(self, client: BroadcastClient) -> None:
+        with self.clients_lock:
+            self.clients.remove(client)
+        return
+
+    def _open_codec(self, width, height):
+        if self.codec_name == "mjpeg":
+            codec = CodecContext.create("mjpeg", "w")
+            codec.pix_fmt = "yuvj420p"
+        else:
+            codec = CodecContext.create("libx264", "w")
+            codec.pix_fmt = "yuv420p"
+            codec.gop_size = self.max_fps
+            codec.max_b_frames = 0
+        #4:2:0 chroma needs even dimensions
+        codec.width = width & ~1
+        codec.height = height & ~1
+        codec.time_base = fractions.Fraction(1, self.max_fps)
+        codec.framerate = fractions.Fraction(self.max_fps, 1)
+        codec.bit_rate = self.bitrate
+        codec.thread_type = self.thread_type
+        codec.thread_count = self.thread_count
+        codec.options = self.options
+        codec.open()
+        return codec
+
+    def _encode_loop(self) -> None:
+        try:
+            self._encode_frames()
+        except Exception as e:
+            #let the request handlers return instead of waiting on a dead encoder
+            print("Broadcast encoder failed:", repr(e))
+            with self.latest_cond:
+                self.alive = False
+        return
+
+    def _encode_frames(self) -> None:
+        interval = 1.0 / self.max_fps
+        while self.alive:
+            with self.latest_cond:
+                while self.latest is None and self.alive:
+                    self.latest_cond.wait()
+                image = self.latest
+                self.latest = None
+            if image is None:
+                continue
+            start = time.time()
+            height, width = image.shape[:2]
+            if self.codec is None or (self.codec.width, self.codec.height) != (width & ~1, height & ~1):
+                #size changed, restart the bitstream so clients resync on the next keyframe
+                self.codec = self._open_codec(width, height)
+                self.frame_index = 0
+            frame = av.VideoFrame.from_ndarray(image, format="bgr24")
+            frame.pts = self.frame_index
+            self.frame_index += 1
+            for packet in self.codec.encode(frame):
+                self._fan_out(bytes(packet), packet.is_keyframe or self.codec_name == "mjpeg")
+            remaining = interval - (time.time() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+        return
+
+    def _fan_out(self, data: bytes, is_keyframe: bool) -> None:
+        with self.clients_lock:
+            clients = list(self.clients)
+        for client in clients:
+            if client.waiting_keyframe:
+                if not is_keyframe:
+                    continue
+                client.waiting_keyframe = False
+            try:
+                client.queue.put_nowait(data)
+            except queue.Full:
+                #slow client, drop its backlog and rejoin at the next keyframe
+                while not client.queue.empty():
+                    try:
+                        client.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                client.waiting_keyframe = True
+        return
+
+class BroadcastRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        encoder = self.server.encoder
+        if self.path != "/":
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Cache-Control", "no-cache")
+        if encoder.codec_name == "mjpeg":
+            self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}")
+        else:
+            self.send_header("Content-Type", "video/h264")
+        self.end_headers()
+
+        client = encoder.add_client()
+        try:
+            while encoder.alive:
+                try:
+                    data = client.queue.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if encoder.codec_name == "mjpeg":
+                    self.wfile.write(
+                        f"--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n\r\n".encode("ascii")
+                    )
+                    self.wfile.write(data)
+                    self.wfile.write(b"\r\n")
+                else:
+                    self.wfile.write(data)
+                self.wfile.flush()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            encoder.remove_client(client)
+        return
+
+    def log_message(self, format, *args):
+        return
+
+class BroadcastServer:
+    """
+    Serves the encoder output over HTTP, MJPEG for browsers or raw H.264 for players such as ffplay
+    """
+    def __init__(self, encoder: BroadcastEncoder, host: str = "0.0.0.0", port: int = 8081):
+        self.encoder = encoder
+        self.httpd = ThreadingHTTPServer((host, port), BroadcastRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.encoder = encoder
+        self.server_thread = None
+        return
+
+    def start(self) -> None:
+        self.server_thread = threading.Thread(target=self.httpd.serve_forever)
+        self.server_thread.start()
+        return
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.server_thread is not None:
+            self.server_thread.join()
+            self.server_thread = None
+        return
@@ -2,15 +2,20 @@ from enum import Enum, IntEnum
 
 class PlEvents(Enum):
     GAZE_DATA = "gaze_data"
+    GAZE_BATCH = "gaze_batch"
     
 class ScrcpyEvents(Enum):
     INIT = "init"
     FRAME = "frame"
     DISCONNECT = "disconnect"
     PACKET = "packet"
+    RECONFIGURE = "reconfigure"
+    RAW_PACKET = "raw_packet"
 
 class ScrcpyControls(IntEnum):
     GET_CURRENT_TIME = 18
 
 class ScrcpyMasks(IntEnum):
-    PACKET_PTS_MASK = (1 << 62) - 1
\ No newline at end of file
+    PACKET_PTS_MASK = (1 << 62) - 1
+    PACKET_FLAG_KEY_FRAME = 1 << 62
+    PACKET_FLAG_CONFIG = 1 << 63
\ No newline at end of file
@@ -43,16 +43,65 @@ class Headset:
                 cv2.CV_16SC2
             ) for i, side in enumerate(("left", "right"))
         )
+        self.periphery_maps = {}
         return
     
     def unwrap(self, frame, side):
         imgremap = cv2.remap(frame, self.maps[side][0], self.maps[side][1], cv2.INTER_LINEAR)
         return imgremap
         
+    def unwrap_stereo(self, frame):
+        #cv2.remap is already parallel internally, extra worker threads per eye bought nothing
+        return tuple(self.unwrap(half, side) for side, half in enumerate(np.hsplit(frame, 2)))
+
+    def roi_window(self, center, size):
+        w, h = self.target_img_size
+        rw, rh = min(size, w), min(size, h)
+        x0 = min(max(int(center[0]) - rw // 2, 0), w - rw)
+        y0 = min(max(int(center[1]) - rh // 2, 0), h - rh)
+        return x0, y0, rw, rh
+
+    def unwrap_roi(self, frame, side, center, size):
+        x0, y0, rw, rh = self.roi_window(center, size)
+        map1, map2 = self.maps[side]
+        imgremap = cv2.remap(frame, map1[y0:y0 + rh, x0:x0 + rw], map2[y0:y0 + rh, x0:x0 + rw], cv2.INTER_LINEAR)
+        return imgremap, (x0, y0)
+
+    def unwrap_periphery(self, frame, side, step):
+        key = (side, step)
+        if key not in self.periphery_maps:
+            #subsampled maps still point at full resolution source pixels
+            self.periphery_maps[key] = tuple(np.ascontiguousarray(m[::step, ::step]) for m in self.maps[side])
+        map1, map2 = self.periphery_maps[key]
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+    def unwrap_foveated(self, frame, side, center, size, periphery_step=0):
+        roi, origin = self.unwrap_roi(frame, side, center, size)
+        periphery = None
+        if periphery_step > 1:
+            periphery = self.unwrap_periphery(frame, side, periphery_step)
+        return roi, origin, periphery
+
+    def compose_foveated(self, roi, origin, periphery, scale=1.0):
+        #composed at display resolution so the cost follows the preview, not the headset
+        size = (int(self.target_img_size[0] * scale), int(self.target_img_size[1] * scale))
+        imgremap = cv2.resize(periphery, size, interpolation=cv2.INTER_NEAREST)
+        if scale != 1:
+            roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        x0, y0 = int(origin[0] * scale), int(origin[1] * scale)
+        h, w = min(roi.shape[0], size[1] - y0), min(roi.shape[1], size[0] - x0)
+        imgremap[y0:y0 + h, x0:x0 + w] = roi[:h, :w]
+        return imgremap
+
     def wrap(self, dir_vec, side):
         dir_vec_h = np.append(dir_vec, 1)
         projected_point = self.P[side] @ dir_vec_h
         return (projected_point / projected_point[2]).astype(int)[:2]
+
+    def wrap_stereo(self, dir_vec):
+        dir_vec_h = np.append(dir_vec, 1)
+        projected_points = np.stack(self.P) @ dir_vec_h
+        return (projected_points / projected_points[:, 2:]).astype(int)[:, :2]
         
 class Neon:
     def __init__(self, ip, port, config_path="data/neon.json"):
@@ -0,0 +1,86 @@
+import time
+import threading
+import cv2
+
+from typing import Any, Callable, Dict
+
+class PreviewRenderer:
+    """
+    Shows the latest submitted frame at a bounded rate, frames submitted in between are skipped
+    """
+    def __init__(
+        self,
+        render: Callable[[Any, Any], Dict[str, Any]],
+        max_fps: float = 30,
+        scale: float = 1.0,
+        show: bool = True
+    ):
+        assert max_fps > 0, "max_fps must be greater than 0"
+        assert 0 < scale <= 1, "scale must be in (0, 1]"
+        self.render = render
+        self.interval = 1.0 / max_fps
+        self.scale = scale
+        self.show = show
+        self.sinks = []
+        self.alive = False
+        self.latest = None
+        self.latest_lock = threading.Lock()
+        self.skipped = 0
+        self.shown = 0
+        return
+
+    def submit(self, frame, gaze) -> None:
+        with self.latest_lock:
+            if self.latest is not None:
+                self.skipped += 1
+            self.latest = (frame, gaze)
+        return
+
+    def add_sink(self, sink: Callable[[Dict[str, Any]], None]) -> None:
+        """
+        Sinks receive every rendered image set before display downscaling
+        """
+        self.sinks.append(sink)
+        return
+
+    def _take_latest(self):
+        with self.latest_lock:
+            item = self.latest
+            self.latest = None
+        return item
+
+    def _show(self, images: Dict[str, Any]) -> None:
+        for sink in self.sinks:
+            sink(images)
+        if self.show is True:
+            for name, image in images.items():
+                if self.scale < 1:
+                    image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+                cv2.imshow(name, image)
+        self.shown += 1
+        return
+
+    def run(self) -> None:
+        """
+        Blocking render loop, call from the main thread since window systems expect it
+        """
+        self.alive = True
+        try:
+            while self.alive:
+                start = time.time()
+                item = self._take_latest()
+                if item is not None:
+                    self._show(self.render(*item))
+                remaining = self.interval - (time.time() - start)
+                if self.show is True:
+                    cv2.waitKey(max(1, int(remaining * 1000)))
+                elif remaining > 0:
+                    time.sleep(remaining)
+        finally:
+            if self.show is True:
+                cv2.destroyAllWindows()
+        return
+
+    def stop(self) -> None:
+        self.alive = False
+        return
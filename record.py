@@ -98,8 +98,13 @@ if __name__ == "__main__":
     cv2.destroyAllWindows()
 
     from streaming import NeonClient, ScrcpyClient
+    from adaptive import AdaptiveStreamController
+    from preview import PreviewRenderer
+    from recording import SessionRecorder
+    from broadcast import BroadcastEncoder, BroadcastServer
     import const
     import time
+    import threading
     from adbutils import adb
 
     def main():
@@ -115,51 +120,192 @@ if __name__ == "__main__":
         parser.add_argument('-p', '--port', help='Neon port', type=int, default=8080)
         parser.add_argument('-d', '--di', help='Adb device index', type=int, default=0)
         parser.add_argument('-s', '--split-fix', help='Replace scrcpy cropping with NumPy horizontal split', action='store_true')
+        parser.add_argument('--stereo', help='Decode the full frame once and render both eyes', choices=('combined', 'split'))
+        parser.add_argument('--headless', help='Skip preview display, and remapping entirely unless broadcasting', action='store_true')
+        parser.add_argument('--preview-fps', help='Max preview refresh rate', type=float, default=30)
+        parser.add_argument('--preview-scale', help='Preview downscaling factor', type=float, default=1.0)
+        parser.add_argument('--foveate', help='Rectify only a square window of this size around the gaze point', type=int)
+        parser.add_argument('--periphery', help='With --foveate, also rectify the periphery at every n-th pixel', type=int, default=0)
+        parser.add_argument('--broadcast', help='Serve the annotated stream over HTTP on this port', type=int)
+        parser.add_argument('--broadcast-codec', help='Broadcast encoding, MJPEG for browsers or raw H.264', choices=('mjpeg', 'h264'), default='mjpeg')
+        parser.add_argument('--broadcast-threads', help='Broadcast encoder threads, 0 picks automatically', type=int, default=0)
+        parser.add_argument('--broadcast-thread-type', help='Broadcast encoder threading, slice threads add no frame delay', choices=('SLICE', 'FRAME', 'AUTO', 'NONE'), default='SLICE')
+        parser.add_argument('--broadcast-preset', help='x264 preset for H.264 broadcast', type=str, default='ultrafast')
+        parser.add_argument('--broadcast-tune', help='x264 tune for H.264 broadcast', type=str, default='zerolatency')
+        parser.add_argument('-g', '--gaze-batch', help='Drain gaze in blocks of up to this many samples, 0 dispatches per sample', type=int, default=0)
+        parser.add_argument('-o', '--output', help='Session directory for raw video, gaze log and seek index', type=str)
+        parser.add_argument('-b', '--bitrate', help='Video bitrate, upper bound in adaptive mode', type=int, default=1600000)
+        parser.add_argument('-f', '--fps', help='Max frame rate, upper bound in adaptive mode', type=int, default=20)
+        parser.add_argument('-a', '--adaptive', help='Adapt bitrate, frame rate and size to link conditions', action='store_true')
+        parser.add_argument('--min-bitrate', help='Adaptive mode lower bitrate bound', type=int, default=400000)
+        parser.add_argument('--min-fps', help='Adaptive mode lower frame rate bound', type=int, default=10)
+        parser.add_argument('--min-size', help='Adaptive mode lower bound of stream size as a fraction of full size', type=float, default=1.0)
         args = parser.parse_args()
 
         headset = Headset(scale)
         matcher = MatchingConsumer()
-        client_gaze = NeonClient(args.ip, args.port)
+        client_gaze = NeonClient(args.ip, args.port, batch_size=args.gaze_batch)
         neon = Neon(client_gaze.ip, client_gaze.port)
         device = adb.device_list()[args.di]
         region = f"{headset.img_size[0]}:{headset.img_size[1]}:{headset.img_size[0] * side}:0"
         max_width=headset.target_img_size[0]
-        if args.split_fix is True:
+        if args.split_fix is True or args.stereo is not None:
             region = None
             max_width = max_width << 1
-        client_frame = ScrcpyClient(device=device, max_width=max_width, bitrate=1600000, max_fps=20, send_frame_meta=True, crop=region)
+        client_frame = ScrcpyClient(device=device, max_width=max_width, bitrate=args.bitrate, max_fps=args.fps, send_frame_meta=True, crop=region)
+        if args.adaptive is True:
+            controller = AdaptiveStreamController(
+                client_frame,
+                min_bitrate=args.min_bitrate,
+                max_bitrate=args.bitrate,
+                min_fps=args.min_fps,
+                max_fps=args.fps,
+                min_width=int(max_width * args.min_size),
+                max_width=max_width,
+                queue_depth=lambda: len(matcher.frame_queue)
+            )
+            controller.attach()
+        frame_size = None
         
         def on_gaze_data(data):
             matcher.gaze_queue.append((data.timestamp_unix_seconds + client_gaze.offset * 0.001, data))
             return
-        client_gaze.add_listener(const.PlEvents.GAZE_DATA, on_gaze_data)
+
+        def on_gaze_batch(block):
+            #copy since the client reuses the block, records keep GazeData attribute access
+            timestamps = block.timestamp_unix_seconds + client_gaze.offset * 0.001
+            matcher.gaze_queue.extend(zip(timestamps.tolist(), block.copy()))
+            return
+
+        if args.gaze_batch > 0:
+            client_gaze.add_listener(const.PlEvents.GAZE_BATCH, on_gaze_batch)
+        else:
+            client_gaze.add_listener(const.PlEvents.GAZE_DATA, on_gaze_data)
 
         def on_frame(frame, pts):
-            if args.split_fix is True:
+            nonlocal frame_size
+            if args.adaptive is True:
+                #keep the size of the first full quality frame when the stream is scaled down
+                if frame_size is None:
+                    frame_size = (frame.shape[1], frame.shape[0])
+                elif (frame.shape[1], frame.shape[0]) != frame_size:
+                    frame = cv2.resize(frame, frame_size, interpolation=cv2.INTER_LINEAR)
+            if args.split_fix is True and args.stereo is None:
                 frame = np.hsplit(frame, 2)[side]
             matcher.frame_queue.append((pts + client_frame.offset * 0.001, frame))
             return
         client_frame.add_listener(const.ScrcpyEvents.FRAME, on_frame)
         
+        encoder = None
+        server = None
+        if args.broadcast is not None:
+            #bind before the clients start so a busy port fails without leaving their threads running
+            options = None
+            if args.broadcast_codec == "h264":
+                options = {"preset": args.broadcast_preset, "tune": args.broadcast_tune}
+            encoder = BroadcastEncoder(
+                args.broadcast_codec,
+                max_fps=args.fps,
+                thread_count=args.broadcast_threads,
+                thread_type=args.broadcast_thread_type,
+                options=options
+            )
+            server = BroadcastServer(encoder, port=args.broadcast)
+            encoder.start()
+            server.start()
+
+        recorder = None
+        if args.output is not None:
+            recorder = SessionRecorder(args.output, client_frame, client_gaze)
+            recorder.attach()
+
         client_gaze.start()
         client_frame.start()
         
-        try:
-            while(True):
+        last_points = [np.array(headset.target_img_size) // 2] * 2
+        def foveate(image, eye, point):
+            if point is not None:
+                last_points[eye] = point
+            #without gaze the window stays where gaze was last seen
+            roi, origin, periphery = headset.unwrap_foveated(image, eye, last_points[eye], args.foveate, args.periphery)
+            if point is not None:
+                cv2.circle(roi, point - origin, 10, (0, 0, 255), 2)
+            if periphery is None:
+                return roi
+            return headset.compose_foveated(roi, origin, periphery, args.preview_scale)
+
+        def render_foveated(frame, gaze):
+            points = (None, None)
+            if gaze is not None:
+                points = headset.wrap_stereo(neon.get_gaze_dir(gaze[1]))
+            if args.stereo is None:
+                return {"frame": foveate(frame[1], side, points[side])}
+            eyes = tuple(map(foveate, np.hsplit(frame[1], 2), (0, 1), points))
+            if args.stereo == "combined":
+                return {"frame": np.hstack(eyes)}
+            return {"frame left": eyes[0], "frame right": eyes[1]}
+
+        def render(frame, gaze):
+            if args.foveate is not None:
+                return render_foveated(frame, gaze)
+            if args.stereo is not None:
+                eyes = headset.unwrap_stereo(frame[1])
+                if gaze is not None:
+                    gaze_dir = neon.get_gaze_dir(gaze[1])
+                    for eye, point in zip(eyes, headset.wrap_stereo(gaze_dir)):
+                        cv2.circle(eye, point, 10, (0, 0, 255), 2)
+                if args.stereo == "combined":
+                    return {"frame": np.hstack(eyes)}
+                return {"frame left": eyes[0], "frame right": eyes[1]}
+            undistorted = headset.unwrap(frame[1], side)
+            if gaze is not None:
+                gaze_dir = neon.get_gaze_dir(gaze[1])
+                point = headset.wrap(gaze_dir, side)
+                cv2.circle(undistorted, point, 10, (0, 0, 255), 2)
+            return {"frame": undistorted}
+
+        renderer = None
+        if args.headless is False or args.broadcast is not None:
+            #foveated composition already draws at preview scale
+            composed = args.foveate is not None and args.periphery > 1
+            preview_scale = 1.0 if composed else args.preview_scale
+            renderer = PreviewRenderer(render, max_fps=args.preview_fps, scale=preview_scale, show=not args.headless)
+
+        if encoder is not None:
+            renderer.add_sink(lambda images: encoder.submit(np.hstack(list(images.values()))))
+
+        matching = True
+        def match_loop():
+            while matching:
                 frame, gaze = matcher.next_match()
-                if frame is not None:
-                    undistorted = headset.unwrap(frame[1], side)
-                    if gaze is not None:
-                        gaze_dir = neon.get_gaze_dir(gaze[1])
-                        point = headset.wrap(gaze_dir, side)
-                        cv2.circle(undistorted, point, 10, (0, 0, 255), 2)
-                    cv2.imshow("frame", undistorted)
-                cv2.waitKey(10)
+                if frame is None:
+                    time.sleep(0.005)
+                elif renderer is not None:
+                    renderer.submit(frame, gaze)
+            return
+        match_thread = threading.Thread(target=match_loop)
+        match_thread.start()
+
+        try:
+            if renderer is not None:
+                renderer.run()
+            else:
+                while(True):
+                    time.sleep(1)
         except KeyboardInterrupt:
             pass
         
+        matching = False
+        match_thread.join()
+        if server is not None:
+            encoder.stop()
+            server.stop()
+        if renderer is not None:
+            print("preview shown", renderer.shown, "skipped", renderer.skipped)
         client_gaze.stop()
         client_frame.stop()
+        if recorder is not None:
+            recorder.close()
         return
     
     def test_neon():
@@ -0,0 +1,325 @@
+import os
+import json
+import threading
+import numpy as np
+import const
+
+from streaming import GAZE_DTYPE
+from av.codec import CodecContext
+
+#one record per video packet, rows are in stream order so byte offsets are increasing
+#scrcpy streams carry no B-frames, so stream order is also presentation order
+INDEX_DTYPE = np.dtype([
+    ("byte_offset", "u8"),
+    ("size", "u4"),
+    ("flags", "u1"),
+    ("pts_raw", "i8"),
+    ("pts", "f8"),
+    ("gaze_offset", "u8"),
+])
+
+FLAG_KEYFRAME = 1
+FLAG_CONFIG = 2
+
+VIDEO_FILE = "video.h264"
+INDEX_FILE = "video.index"
+GAZE_FILE = "gaze.bin"
+META_FILE = "meta.json"
+
+class SessionRecorder:
+    """
+    Writes the raw H.264 stream, the gaze log and a per-packet sidecar index into a session directory
+    """
+    def __init__(self, path, client_frame, client_gaze):
+        self.path = path
+        self.client_frame = client_frame
+        self.client_gaze = client_gaze
+        os.makedirs(path, exist_ok=True)
+        self.video_file = open(os.path.join(path, VIDEO_FILE), "wb")
+        self.index_file = open(os.path.join(path, INDEX_FILE), "wb")
+        self.gaze_file = open(os.path.join(path, GAZE_FILE), "wb")
+        self.video_offset = 0
+        self.frame_seen = False
+        self.gaze_seen = False
+        self.meta_written = False
+        self.gaze_record = np.recarray(1, dtype=GAZE_DTYPE)
+        self.index_record = np.zeros(1, dtype=INDEX_DTYPE)
+        self.lock = threading.Lock()
+        return
+
+    def attach(self) -> None:
+        self.client_frame.add_listener(const.ScrcpyEvents.RAW_PACKET, self.on_raw_packet)
+        if self.client_gaze.batch_size > 0:
+            self.client_gaze.add_listener(const.PlEvents.GAZE_BATCH, self.on_gaze_batch)
+        else:
+            self.client_gaze.add_listener(const.PlEvents.GAZE_DATA, self.on_gaze_data)
+        return
+
+    def detach(self) -> None:
+        self.client_frame.remove_listener(const.ScrcpyEvents.RAW_PACKET, self.on_raw_packet)
+        if self.client_gaze.batch_size > 0:
+            self.client_gaze.remove_listener(const.PlEvents.GAZE_BATCH, self.on_gaze_batch)
+        else:
+            self.client_gaze.remove_listener(const.PlEvents.GAZE_DATA, self.on_gaze_data)
+        return
+
+    def on_raw_packet(self, raw_h264, pts, is_keyframe, is_config) -> None:
+        record = self.index_record
+        record["byte_offset"] = self.video_offset
+        record["size"] = len(raw_h264)
+        record["flags"] = (FLAG_KEYFRAME if is_keyframe else 0) | (FLAG_CONFIG if is_config else 0)
+        record["pts_raw"] = pts
+        record["pts"] = (pts + self.client_frame.offset) * 0.001
+        #filled in by _index_gaze on close, until then readers search gaze by timestamp
+        record["gaze_offset"] = 0
+        with self.lock:
+            self.video_file.write(raw_h264)
+            self.index_file.write(record.tobytes())
+        self.video_offset += len(raw_h264)
+        if not self.frame_seen:
+            self.frame_seen = True
+            self._try_write_meta()
+        return
+
+    def on_gaze_data(self, data) -> None:
+        record = self.gaze_record
+        record.timestamp_unix_seconds = data.timestamp_unix_seconds
+        record.x = data.x
+        record.y = data.y
+        record.worn = data.worn
+        record.pupil_diameter_left = getattr(data, "pupil_diameter_left", np.nan)
+        record.pupil_diameter_right = getattr(data, "pupil_diameter_right", np.nan)
+        self._write_gaze(record.tobytes())
+        return
+
+    def on_gaze_batch(self, block) -> None:
+        self._write_gaze(block.tobytes())
+        return
+
+    def _write_gaze(self, data) -> None:
+        with self.lock:
+            self.gaze_file.write(data)
+        if not self.gaze_seen:
+            self.gaze_seen = True
+            self._try_write_meta()
+        return
+
+    def _try_write_meta(self) -> None:
+        #both clients set their offset before emitting data, so the offsets are final once each has sent something
+        with self.lock:
+            if self.frame_seen and self.gaze_seen and not self.meta_written:
+                self._write_meta(gaze_indexed=False)
+                self.meta_written = True
+        return
+
+    def _write_meta(self, gaze_indexed) -> None:
+        meta = {
+            "frame_offset_ms": self.client_frame.offset,
+            "gaze_offset_ms": self.client_gaze.offset,
+            "gaze_indexed": gaze_indexed,
+            "index_dtype": INDEX_DTYPE.descr,
+            "gaze_dtype": GAZE_DTYPE.descr
+        }
+        #replace atomically so a crash never leaves a truncated file
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f, indent=4)
+        os.replace(meta_path + ".tmp", meta_path)
+        return
+
+    def _index_gaze(self) -> None:
+        #both streams arrive independently, so packets are matched to gaze by timestamp instead of arrival order
+        index_path = os.path.join(self.path, INDEX_FILE)
+        index = np.fromfile(index_path, dtype=INDEX_DTYPE)
+        gaze = np.fromfile(os.path.join(self.path, GAZE_FILE), dtype=GAZE_DTYPE)
+        timestamps = gaze["timestamp_unix_seconds"] + self.client_gaze.offset * 0.001
+        index["gaze_offset"] = np.searchsorted(timestamps, index["pts"], side="left") * GAZE_DTYPE.itemsize
+        index.tofile(index_path)
+        return
+
+    def close(self) -> None:
+        self.detach()
+        with self.lock:
+            for f in (self.video_file, self.index_file, self.gaze_file):
+                f.close()
+        self._index_gaze()
+        self._write_meta(gaze_indexed=True)
+        return
+
+def _load_records(path, dtype):
+    #an interrupted session can end in a partially written record
+    count = os.path.getsize(path) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+class SessionReader:
+    """
+    Seeks recorded sessions by timestamp using the sidecar index instead of decoding from the start
+    """
+    def __init__(self, path):
+        self.path = path
+        self.meta = {"frame_offset_ms": 0, "gaze_offset_ms": 0}
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                self.meta = json.load(f)
+        else:
+            print("No session meta, gaze and video clocks are not aligned")
+        self.index = _load_records(os.path.join(path, INDEX_FILE), INDEX_DTYPE)
+        self.gaze = _load_records(os.path.join(path, GAZE_FILE), GAZE_DTYPE)
+        self.video_file = open(os.path.join(path, VIDEO_FILE), "rb")
+
+        flags = self.index["flags"]
+        self.frame_rows = np.flatnonzero((flags & FLAG_CONFIG) == 0)
+        self.frame_pts = np.asarray(self.index["pts"][self.frame_rows])
+        self.keyframe_rows = np.flatnonzero(flags & FLAG_KEYFRAME)
+        self.config_rows = np.flatnonzero(flags & FLAG_CONFIG)
+        return
+
+    @property
+    def duration(self):
+        if len(self.frame_pts) == 0:
+            return 0.0
+        return self.frame_pts[-1] - self.frame_pts[0]
+
+    def gaze_timestamps(self):
+        return self.gaze["timestamp_unix_seconds"] + self.meta["gaze_offset_ms"] * 0.001
+
+    def seek(self, t):
+        """
+        Index row of the last frame packet at or before t
+        """
+        if len(self.frame_rows) == 0:
+            raise IndexError("Session has no frames")
+        i = np.searchsorted(self.frame_pts, t, side="right") - 1
+        return int(self.frame_rows[max(i, 0)])
+
+    def keyframe_before(self, row):
+        i = np.searchsorted(self.keyframe_rows, row, side="right") - 1
+        if i < 0:
+            raise IndexError(f"No keyframe before packet {row}")
+        return int(self.keyframe_rows[i])
+
+    def config_before(self, row):
+        i = np.searchsorted(self.config_rows, row, side="right") - 1
+        return int(self.config_rows[i]) if i >= 0 else None
+
+    def read_rows(self, first, last):
+        """
+        Raw bytes of packets first..last, they are contiguous in the video file
+        """
+        start = int(self.index["byte_offset"][first])
+        end = int(self.index["byte_offset"][last]) + int(self.index["size"][last])
+        self.video_file.seek(start)
+        return self.video_file.read(end - start)
+
+    def _decodable_bytes(self, row):
+        #SPS/PPS are only sent at stream start and after reconnects
+        keyframe = self.keyframe_before(row)
+        config = self.config_before(keyframe)
+        data = self.read_rows(keyframe, row)
+        if config is not None and config != keyframe:
+            data = self.read_rows(config, config) + data
+        return data
+
+    def frame_at(self, t):
+        """
+        Decode the frame shown at time t, starting from the closest preceding keyframe
+        """
+        row = self.seek(t)
+        data = self._decodable_bytes(row)
+        codec = CodecContext.create("h264", "r")
+        frame = None
+        for packet in codec.parse(data) + codec.parse(None):
+            for decoded in codec.decode(packet):
+                frame = decoded
+        for decoded in codec.decode(None):
+            frame = decoded
+        if frame is None:
+            return None, None
+        return float(self.index["pts"][row]), frame.to_ndarray(format="bgr24")
+
+    def gaze_row(self, row):
+        """
+        First gaze sample at or after the pts of index row
+        """
+        return int(self.index["gaze_offset"][row]) // GAZE_DTYPE.itemsize
+
+    def _gaze_range(self, t0, t1):
+        timestamps = self.gaze["timestamp_unix_seconds"]
+        offset = self.meta["gaze_offset_ms"] * 0.001
+        lo, hi = 0, len(timestamps)
+        if self.meta.get("gaze_indexed", False) and len(self.frame_rows) > 0:
+            #the frames around t0 and t1 bracket the search to a few gaze samples
+            i0 = np.searchsorted(self.frame_pts, t0, side="right") - 1
+            i1 = np.searchsorted(self.frame_pts, t1, side="left")
+            if i0 >= 0:
+                lo = self.gaze_row(self.frame_rows[i0])
+            if i1 < len(self.frame_rows):
+                hi = max(min(self.gaze_row(self.frame_rows[i1]) + 1, hi), lo)
+        window = timestamps[lo:hi]
+        first = lo + int(np.searchsorted(window, t0 - offset, side="left"))
+        last = lo + int(np.searchsorted(window, t1 - offset, side="right"))
+        return first, last
+
+    def gaze_between(self, t0, t1):
+        first, last = self._gaze_range(t0, t1)
+        return self.gaze[first:last]
+
+    def extract_clip(self, t0, t1, path):
+        """
+        Copy packets and gaze between t0 and t1 into a new session without decoding
+        """
+        first_row = self.seek(t0)
+        last_row = self.seek(t1)
+        keyframe = self.keyframe_before(first_row)
+        config = self.config_before(keyframe)
+        video = self.read_rows(keyframe, last_row)
+        index = np.array(self.index[keyframe:last_row + 1])
+        if config is not None and config != keyframe:
+            video = self.read_rows(config, config) + video
+            index = np.concatenate((np.array(self.index[config:config + 1]), index))
+        gaze_first, gaze_last = self._gaze_range(self.index["pts"][keyframe], t1)
+        gaze = np.array(self.gaze[gaze_first:gaze_last])
+
+        #rebase offsets so the clip is a standalone session
+        index["byte_offset"] = np.concatenate(((0,), np.cumsum(index["size"][:-1], dtype="u8")))
+        gaze_offset = index["gaze_offset"].astype("i8") - gaze_first * GAZE_DTYPE.itemsize
+        index["gaze_offset"] = np.clip(gaze_offset, 0, gaze.nbytes)
+
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, VIDEO_FILE), "wb") as f:
+            f.write(video)
+        with open(os.path.join(path, INDEX_FILE), "wb") as f:
+            f.write(index.tobytes())
+        with open(os.path.join(path, GAZE_FILE), "wb") as f:
+            f.write(gaze.tobytes())
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=4)
+        return
+
+    def close(self):
+        self.video_file.close()
+        return
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import cv2
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='Session directory', type=str)
+    parser.add_argument('-t', '--time', help='Seconds from session start', type=float, default=0)
+    args = parser.parse_args()
+
+    reader = SessionReader(args.path)
+    print("duration", reader.duration, "packets", len(reader.index), "keyframes", len(reader.keyframe_rows))
+    t = reader.frame_pts[0] + args.time
+    start = time.time()
+    pts, frame = reader.frame_at(t)
+    print("seek took", time.time() - start, "frame pts", pts, "gaze samples", len(reader.gaze_between(t - 0.05, t + 0.05)))
+    if frame is not None:
+        cv2.imshow("frame", frame)
+        cv2.waitKey(0)
+    reader.close()
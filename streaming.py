@@ -1,8 +1,12 @@
 import time
 import abc
 import const
+import asyncio
 import threading
+import collections
+import numpy as np
 
+from pupil_labs.realtime_api import receive_gaze_data
 from pupil_labs.realtime_api.simple import Device
 from typing import Any, Callable, Optional, Tuple, Union
 
@@ -13,6 +17,16 @@ from control import ControlSender
 from adbutils import AdbConnection, AdbError, AdbDevice, Network
 from av.codec import CodecContext
 
+#field names follow GazeData so records can stand in for per-sample objects
+GAZE_DTYPE = np.dtype([
+    ("timestamp_unix_seconds", "f8"),
+    ("x", "f4"),
+    ("y", "f4"),
+    ("worn", "?"),
+    ("pupil_diameter_left", "f4"),
+    ("pupil_diameter_right", "f4"),
+])
+
 class StreamClient(abc.ABC):
 
     def __init__(self, events):
@@ -60,11 +74,23 @@ class StreamClient(abc.ABC):
         return
 
 class NeonClient(StreamClient):
-    def __init__(self, ip=None, port=None, device=None):
+    def __init__(self, ip=None, port=None, device=None, batch_size=0, block_count=4, buffer_limit=1000, batch_interval=0.02):
         super().__init__(const.PlEvents)
+        assert batch_size >= 0, "batch_size must be greater than or equal to 0"
+        assert block_count > 0, "block_count must be greater than 0"
+        assert buffer_limit >= batch_size, "buffer_limit must be at least batch_size"
         self.ip = ip
         self.port = port
         self.device = device
+        #GAZE_BATCH blocks are reused after block_count batches, listeners copy what they keep
+        self.batch_size = batch_size
+        self.block_count = block_count
+        #samples arrive one per RTSP packet, pacing lets them accumulate into a block
+        self.batch_interval = batch_interval
+        #the simple API keeps only the newest datum, batch mode buffers the RTSP stream itself
+        self.gaze_buffer = collections.deque(maxlen=buffer_limit)
+        self.gaze_ready = threading.Event()
+        self.receive_thread = None
         return
         
     def _stream_loop(self):
@@ -77,10 +103,72 @@ class NeonClient(StreamClient):
                 raise ConnectionError("No device found.")
         self.offset = self.device.estimate_time_offset().time_offset_ms.mean
         print("OFFSET", self.offset)
+        if self.batch_size > 0:
+            self._batch_loop()
+            return
         while self.alive:
             data = self.device.receive_gaze_datum()
             self._send_to_listeners(const.PlEvents.GAZE_DATA, data)
         return
+
+    async def _receive_gaze(self, url):
+        async for data in receive_gaze_data(url):
+            self.gaze_buffer.append(data)
+            self.gaze_ready.set()
+            if not self.alive:
+                break
+        return
+
+    def _batch_loop(self):
+        sensor = self.device.gaze_sensor()
+        if sensor is None or sensor.url is None:
+            raise ConnectionError("Gaze sensor not connected.")
+        #daemon since a stalled stream would otherwise block shutdown until the next datum
+        self.receive_thread = threading.Thread(
+            target=asyncio.run,
+            args=(self._receive_gaze(sensor.url),),
+            daemon=True
+        )
+        self.receive_thread.start()
+
+        blocks = np.recarray((self.block_count, self.batch_size), dtype=GAZE_DTYPE)
+        nan = float("nan")
+        block_index = 0
+        last_batch = 0
+        while self.alive:
+            self.gaze_ready.clear()
+            if len(self.gaze_buffer) == 0:
+                self.gaze_ready.wait(timeout=0.5)
+                continue
+            remaining = self.batch_interval - (time.time() - last_batch)
+            if remaining > 0 and len(self.gaze_buffer) < self.batch_size:
+                time.sleep(remaining)
+            last_batch = time.time()
+            block = blocks[block_index]
+            block_index = (block_index + 1) % self.block_count
+            samples = [] if len(self.listeners[const.PlEvents.GAZE_DATA]) > 0 else None
+            count = 0
+            while count < self.batch_size:
+                try:
+                    data = self.gaze_buffer.popleft()
+                except IndexError:
+                    break
+                block[count] = (
+                    data.timestamp_unix_seconds,
+                    data.x,
+                    data.y,
+                    data.worn,
+                    getattr(data, "pupil_diameter_left", nan),
+                    getattr(data, "pupil_diameter_right", nan)
+                )
+                if samples is not None:
+                    samples.append(data)
+                count += 1
+            self._send_to_listeners(const.PlEvents.GAZE_BATCH, block[:count])
+            if samples is not None:
+                for data in samples:
+                    self._send_to_listeners(const.PlEvents.GAZE_DATA, data)
+        return
         
     def stop(self):
         super().stop()
@@ -134,6 +222,32 @@ class ScrcpyClient(StreamClient):
         self._video_socket = None
         self.control_socket = None
         self.control_socket_lock = threading.Lock()
+
+        self._jar_device_path = None
+        self._reconfigure_pending = False
+        self._params_lock = threading.Lock()
+        return
+
+    def reconfigure(
+        self,
+        bitrate: Optional[int] = None,
+        max_fps: Optional[int] = None,
+        max_width: Optional[int] = None
+    ) -> None:
+        """
+        Request new encoder parameters, applied by restarting the already deployed server
+        """
+        with self._params_lock:
+            if bitrate is not None:
+                assert bitrate >= 0, "bitrate must be greater than or equal to 0"
+                self.bitrate = bitrate
+            if max_fps is not None:
+                assert max_fps >= 0, "max_fps must be greater than or equal to 0"
+                self.max_fps = max_fps
+            if max_width is not None:
+                assert max_width >= 0, "max_width must be greater than or equal to 0"
+                self.max_width = max_width
+            self._reconfigure_pending = True
         return
 
     def _init_server_connection(self) -> None:
@@ -171,10 +285,14 @@ class ScrcpyClient(StreamClient):
         jar_abs_path = os.path.join(
             os.path.abspath(os.path.dirname(__file__)), jar_path
         )
-        jar_device_path = f"/data/local/tmp/{jar_name}"
-        self.device.sync.push(jar_abs_path, jar_device_path)
+        self._jar_device_path = f"/data/local/tmp/{jar_name}"
+        self.device.sync.push(jar_abs_path, self._jar_device_path)
+        self._start_server()
+        return
+
+    def _start_server(self) -> None:
         commands = [
-            f"CLASSPATH={jar_device_path}",
+            f"CLASSPATH={self._jar_device_path}",
             "app_process",
             "/",
             "com.genymobile.scrcpy.Server",
@@ -206,6 +324,18 @@ class ScrcpyClient(StreamClient):
         # Wait for server to start
         self._server_stream.read(10)
         return
+
+    def _restart_server(self) -> None:
+        #jar is already on the device, only the server process and sockets are renewed
+        with self._params_lock:
+            self._reconfigure_pending = False
+            with self.control_socket_lock:
+                self.try_close_socket(self._video_socket)
+                self.try_close_socket(self.control_socket)
+                self.try_close_socket(self._server_stream)
+                self._start_server()
+                self._init_server_connection()
+        return
         
     def _estimate_time_offset(self, number_of_measurements=100):
         diff_total = 0
@@ -231,21 +361,35 @@ class ScrcpyClient(StreamClient):
         
         while self.alive:
             try:
+                if self._reconfigure_pending:
+                    #device clock is unchanged, offset estimate stays valid
+                    self._restart_server()
+                    codec = CodecContext.create("h264", "r")
+                    keyframe_recorded = False
+                    self._send_to_listeners(const.ScrcpyEvents.RECONFIGURE)
                 pts = 0
                 if self.send_frame_meta:
                     video_header = self._video_socket.recv(12)
                     if len(video_header) != 12:
                         raise ConnectionError("Video header is less than 12 bytes")
                     
-                    (pts, data_packet_length) = struct.unpack(">QL", video_header)
-                    pts = pts & const.ScrcpyMasks.PACKET_PTS_MASK
+                    (pts_flags, data_packet_length) = struct.unpack(">QL", video_header)
+                    pts = pts_flags & const.ScrcpyMasks.PACKET_PTS_MASK
                     #print(pts)
-                raw_h264 = self._video_socket.recv(65535)
+                    raw_h264 = self._recv_exact(data_packet_length)
+                    is_keyframe = bool(pts_flags & const.ScrcpyMasks.PACKET_FLAG_KEY_FRAME)
+                    is_config = bool(pts_flags & const.ScrcpyMasks.PACKET_FLAG_CONFIG)
+                else:
+                    raw_h264 = self._video_socket.recv(65535)
                 t = raw_h264[4] & 0x1F
+                if not self.send_frame_meta:
+                    is_keyframe = t == 5
+                    is_config = t == 7
                 if t == 5:#keyframe nal
                     keyframe_recorded = True
                 elif t != 7 and keyframe_recorded is False:
                     continue
+                self._send_to_listeners(const.ScrcpyEvents.RAW_PACKET, raw_h264, pts, is_keyframe, is_config)
                 packets = codec.parse(raw_h264)
                 for packet in packets:
                     self._send_to_listeners(const.ScrcpyEvents.PACKET, packet, codec, pts_ts)
@@ -262,6 +406,16 @@ class ScrcpyClient(StreamClient):
                     raise e
         return
         
+    def _recv_exact(self, length: int) -> bytes:
+        chunks = []
+        while length > 0:
+            chunk = self._video_socket.recv(min(length, 65535))
+            if not len(chunk):
+                raise ConnectionError("Video socket closed mid packet")
+            chunks.append(chunk)
+            length -= len(chunk)
+        return b"".join(chunks)
+
     def try_close_socket(self, socket):
         if socket is not None:
             try: